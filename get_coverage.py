@@ -1,78 +1,293 @@
-from pystac import Catalog, Item, Collection
 import geopandas as gpd
-import folium
-import requests
-from urllib.parse import urlparse
+import shapely
+import numpy as np
+import pyarrow as pa
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from urllib.parse import urljoin
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import orjson
 import os
+import stac_fetch
+from stac_fetch import MAX_WORKERS, fetch_json, fetch_bytes_async, bulk_download
+
+# Concurrent requests allowed on the --async path
+ASYNC_CONCURRENCY = 64
+
+# Tooltip shown for each footprint on the folium map
+TOOLTIP_TEMPLATE = "<b>ID:</b> {id}<br><b>Date:</b> {datetime}<br><b>Collection:</b> {collection}".format_map
+
+# Function to list the absolute hrefs of a STAC document's links with the given rel
+def link_hrefs(stac_dict, base_href, rel):
+    return [urljoin(base_href, link["href"]) for link in stac_dict.get("links", []) if link.get("rel") == rel]
+
+parser = argparse.ArgumentParser(description="Map the footprints of every item in the Wyvern STAC catalog")
+parser.add_argument("--legacy", action="store_true",
+                    help="render the map with folium/Leaflet instead of lonboard/deck.gl")
+parser.add_argument("--stream-footprints", action="store_true",
+                    help="with --legacy, write footprints to coverage.ndjson and stream them into the map in the "
+                         "browser instead of embedding them in the HTML (the map must then be served over HTTP)")
+fetch_mode = parser.add_mutually_exclusive_group()
+fetch_mode.add_argument("--async", dest="use_async", action="store_true",
+                        help="fetch the catalog with asyncio/aiohttp instead of a thread pool")
+fetch_mode.add_argument("--bulk-download-dir", metavar="DIR",
+                        help="download all item JSON into DIR with aria2c first, then read it from there "
+                             "(DIR is also used as the cache directory)")
+args = parser.parse_args()
+if args.stream_footprints and not args.legacy:
+    parser.error("--stream-footprints only applies to the --legacy folium map")
+
+if args.bulk_download_dir:
+    stac_fetch.CACHE_DIR = Path(args.bulk_download_dir)
 
 # Load the root catalog
 catalog_url = "https://wyvern-prod-public-open-data-program.s3.ca-central-1.amazonaws.com/catalog.json"
-catalog = Catalog.from_file(catalog_url)
-
-# Function to recursively get all items from the catalog
-def get_all_items(catalog):
-    items = []
-    print(f"Processing {catalog.id} ({catalog.STAC_OBJECT_TYPE})")
-    
-    # Process child catalogs/collections
-    for child_link in catalog.get_child_links():
-        print(f"Processing child {child_link.href}")
-        child = catalog.get_single_link("child").resolve_stac_object(root=catalog).target
-        if isinstance(child, (Catalog, Collection)):
-            items.extend(get_all_items(child))
-    
-    # Process items directly in this catalog
-    for item_link in catalog.get_item_links():
-        try:
-            item = item_link.resolve_stac_object(root=catalog).target
-            if isinstance(item, Item):
-                items.append(item)
-        except Exception as e:
-            print(f"Error loading item {item_link.href}: {str(e)}")
-    
-    return items
+catalog = fetch_json(catalog_url, cache=False)
+
+# Function to collect the href of every item in the catalog
+def get_item_hrefs(catalog_href, catalog):
+    hrefs = []
+    seen = set()
+    queue = deque([(catalog_href, catalog)])
+    while queue:
+        current_href, current = queue.popleft()
+        print(f"Processing {current['id']} ({current.get('type')})")
+
+        # Queue child catalogs/collections
+        for child_href in link_hrefs(current, current_href, "child"):
+            print(f"Processing child {child_href}")
+            if child_href in seen:
+                continue
+            seen.add(child_href)
+            child = fetch_json(child_href, cache=False)
+            if child.get("type") in ("Catalog", "Collection"):
+                queue.append((child_href, child))
+
+        # Collect items directly in this catalog
+        for href in link_hrefs(current, current_href, "item"):
+            if href not in seen:
+                seen.add(href)
+                hrefs.append(href)
+
+    return hrefs
+
+# Function to reduce an item document to the columns the coverage map needs; the
+# map never uses assets or links, so the raw JSON is read directly without pystac.
+# STAC datetimes are already ISO 8601 strings, so they are passed through as-is.
+def footprint_row(item):
+    return (
+        item["id"],
+        item["properties"].get("datetime"),
+        item.get("collection"),
+        json.dumps(item["geometry"])
+    )
+
+# Function to fetch a single item's footprint
+def fetch_footprint(href):
+    try:
+        return footprint_row(fetch_json(href))
+    except Exception as e:
+        print(f"Error loading item {href}: {str(e)}")
+        return None
+
+# Function to get the footprint of every item in the catalog, fetching them in parallel
+def get_all_footprints(hrefs):
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        rows = executor.map(fetch_footprint, hrefs)
+        return [row for row in rows if row is not None]
+
+# Function to pack footprint rows into one columnar Arrow table with WKB geometries,
+# tagged as geoarrow.wkb so GeoPandas picks the geometry column up directly
+def footprints_to_table(rows):
+    ids, datetimes, collections, geometries = zip(*rows)
+    # (items without a footprint come through as missing geometries; malformed
+    # ones are warned about and also come through as missing)
+    wkb = shapely.to_wkb(shapely.from_geojson(np.array(geometries, dtype=object), on_invalid="warn"))
+    schema = pa.schema([
+        pa.field("id", pa.string()),
+        pa.field("datetime", pa.string()),
+        pa.field("collection", pa.string()),
+        pa.field("geometry", pa.binary(), metadata={"ARROW:extension:name": "geoarrow.wkb"})
+    ])
+    return pa.Table.from_arrays(
+        [
+            pa.array(ids, type=pa.string()),
+            pa.array(datetimes, type=pa.string()),
+            pa.array(collections, type=pa.string()),
+            pa.array(wkb, type=pa.binary())
+        ],
+        schema=schema
+    )
+
+# Function to write footprints as line-delimited GeoJSON, one Feature per line,
+# carrying only the pre-rendered tooltip as properties
+def write_footprints_ndjson(gdf, path):
+    geometries = shapely.to_geojson(gdf.geometry.to_numpy())
+    with open(path, "w") as f:
+        for geometry, tooltip in zip(geometries, gdf["tooltip"]):
+            properties = json.dumps({"tooltip": tooltip})
+            f.write(f'{{"type": "Feature", "geometry": {geometry or "null"}, "properties": {properties}}}\n')
+
+# Async counterpart of fetch_footprint
+async def fetch_footprint_async(href, client, semaphore):
+    try:
+        return footprint_row(orjson.loads(await fetch_bytes_async(href, client, semaphore)))
+    except Exception as e:
+        print(f"Error loading item {href}: {str(e)}")
+        return None
+
+# Function to get all footprints on a single event loop instead of a thread pool
+async def get_all_footprints_async(catalog_href, catalog):
+    # aiohttp is only needed for --async, so don't require it otherwise
+    import aiohttp
+
+    semaphore = asyncio.Semaphore(ASYNC_CONCURRENCY)
+    connector = aiohttp.TCPConnector(limit=ASYNC_CONCURRENCY)
+    async with aiohttp.ClientSession(connector=connector) as client:
+        # Walk the tree one level at a time, fetching each level's children concurrently
+        hrefs = []
+        seen = set()
+        level = [(catalog_href, catalog)]
+        while level:
+            child_hrefs = []
+            for current_href, current in level:
+                print(f"Processing {current['id']} ({current.get('type')})")
+                for child_href in link_hrefs(current, current_href, "child"):
+                    if child_href not in seen:
+                        print(f"Processing child {child_href}")
+                        seen.add(child_href)
+                        child_hrefs.append(child_href)
+                for href in link_hrefs(current, current_href, "item"):
+                    if href not in seen:
+                        seen.add(href)
+                        hrefs.append(href)
+
+            payloads = await asyncio.gather(*[fetch_bytes_async(href, client, semaphore, cache=False)
+                                             for href in child_hrefs])
+            children = [(href, orjson.loads(payload)) for href, payload in zip(child_hrefs, payloads)]
+            level = [(href, child) for href, child in children if child.get("type") in ("Catalog", "Collection")]
+
+        rows = await asyncio.gather(*[fetch_footprint_async(href, client, semaphore) for href in hrefs])
+        return [row for row in rows if row is not None]
 
 print("Loading catalog items...")
-all_items = get_all_items(catalog)
+if args.use_async:
+    rows = asyncio.run(get_all_footprints_async(catalog_url, catalog))
+else:
+    hrefs = get_item_hrefs(catalog_url, catalog)
+    if args.bulk_download_dir:
+        bulk_download(hrefs)
+    rows = get_all_footprints(hrefs)
 
-if not all_items:
+if not rows:
     raise Exception("No items found in the catalog. Possible reasons:\n"
                     "1. Catalog structure is different than expected\n"
                     "2. Items are in protected collections\n"
                     "3. Network restrictions prevent access")
 
-print(f"Found {len(all_items)} items")
-
-# Create GeoDataFrame from item geometries
-gdf = gpd.GeoDataFrame.from_features([
-    {
-        "type": "Feature",
-        "geometry": item.geometry,
-        "properties": {
-            "id": item.id,
-            "datetime": item.datetime.isoformat() if item.datetime else None,
-            "collection": item.collection_id
-        }
-    }
-    for item in all_items
-])
-
-# Create a world map centered at (0,0)
-m = folium.Map(location=[0, 0], zoom_start=2)
-
-# Add all footprints to the map
-for _, row in gdf.iterrows():
-    folium.GeoJson(
-        row.geometry,
-        tooltip=f"""
-        <b>ID:</b> {row['id']}<br>
-        <b>Date:</b> {row['datetime']}<br>
-        <b>Collection:</b> {row['collection']}
-        """
-    ).add_to(m)
-
-# Save the map
+table = footprints_to_table(rows)
+del rows
+print(f"Found {table.num_rows} items")
+
+# Create GeoDataFrame straight from the Arrow table
+gdf = gpd.GeoDataFrame.from_arrow(table).set_crs("EPSG:4326")
+missing_footprints = gdf.geometry.isna().sum()
+if missing_footprints:
+    print(f"{missing_footprints} items have no valid footprint and were left off the map")
+
 output_dir = "Dragonette-Imagery-API/result"
 os.makedirs(output_dir, exist_ok=True)
-m.save(f"{output_dir}/wyvern_data_coverage.html")
+
+if args.legacy:
+    # folium (with its branca and jinja2 dependencies) is only needed for this map,
+    # so the default lonboard map works without it
+    import folium
+    from branca.element import MacroElement
+    from jinja2 import Template
+
+    # Create a world map centered at (0,0)
+    m = folium.Map(location=[0, 0], zoom_start=2)
+
+    # Render every tooltip up front with the precompiled template, then keep only
+    # it and the geometry so each footprint's properties are not shipped twice
+    gdf["tooltip"] = [TOOLTIP_TEMPLATE(row) for row in gdf[["id", "datetime", "collection"]].to_dict("records")]
+    footprints = gdf[["tooltip", "geometry"]]
+
+    if args.stream_footprints:
+        # Map element that fetches an ndjson file and adds features to one layer as lines arrive
+        class NdjsonFootprints(MacroElement):
+            _template = Template("""
+                {% macro script(this, kwargs) %}
+                (function() {
+                    var layer = L.geoJSON(null, {
+                        onEachFeature: function(feature, featureLayer) {
+                            featureLayer.bindTooltip(feature.properties.tooltip);
+                        }
+                    }).addTo({{ this._parent.get_name() }});
+
+                    function addLine(line) {
+                        if (line) {
+                            layer.addData(JSON.parse(line));
+                        }
+                    }
+
+                    fetch({{ this.url|tojson }}).then(async function(response) {
+                        var reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+                        var buffer = "";
+                        while (true) {
+                            var chunk = await reader.read();
+                            if (chunk.done) {
+                                break;
+                            }
+                            buffer += chunk.value;
+                            var lines = buffer.split("\\n");
+                            buffer = lines.pop();
+                            lines.forEach(addLine);
+                        }
+                        addLine(buffer);
+                    }).catch(function(error) {
+                        // Browsers refuse fetch() from file:// pages, which leaves the map empty
+                        console.error("Could not load " + {{ this.url|tojson }} + ": " + error);
+                        alert("Could not load the footprints. This map must be served over HTTP, "
+                              + "e.g. run `python -m http.server` in its directory and open it from there.");
+                    });
+                })();
+                {% endmacro %}
+            """)
+
+            def __init__(self, url):
+                super().__init__()
+                self._name = "NdjsonFootprints"
+                self.url = url
+
+        # Keep the footprints out of the HTML and let the browser stream them in
+        write_footprints_ndjson(footprints, f"{output_dir}/coverage.ndjson")
+        print(f"Footprints saved to {output_dir}/coverage.ndjson")
+        NdjsonFootprints("coverage.ndjson").add_to(m)
+    else:
+        # Add all footprints to the map as a single layer
+        folium.GeoJson(
+            footprints,
+            tooltip=folium.GeoJsonTooltip(fields=["tooltip"], labels=False)
+        ).add_to(m)
+
+    # Save the map
+    m.save(f"{output_dir}/wyvern_data_coverage.html")
+else:
+    # Draw all footprints in one deck.gl layer on the GPU; lonboard ships the
+    # geometries to the browser as Arrow/WKB rather than as per-feature DOM nodes.
+    # lonboard is only needed for this map, so --legacy works without it
+    from lonboard import Map, PolygonLayer
+
+    layer = PolygonLayer.from_geopandas(
+        gdf[gdf.geometry.notna()],
+        get_fill_color=[0, 0, 255, 40],
+        get_line_color=[0, 0, 255, 200],
+        line_width_min_pixels=1
+    )
+    Map(layer).to_html(f"{output_dir}/wyvern_data_coverage.html")
+
 print(f"Map saved to {output_dir}/wyvern_data_coverage.html")
@@ -2,62 +2,203 @@ from reportlab.lib.pagesizes import letter
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, PageBreak, Table, TableStyle
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib import colors
-from pystac import Catalog, Item, Collection    
+import pystac
+from pystac import Catalog, Item, Collection, StacIO
+from pystac.stac_io import DefaultStacIO
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import deque
+from itertools import chain, islice
 import datetime
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 from io import BytesIO
+from pathlib import Path
+from urllib.parse import urlparse
 import numpy as np
+import argparse
+import asyncio
+import contextlib
+import multiprocessing
+import orjson
 import os
+import stac_fetch
+from stac_fetch import MAX_WORKERS, fetch_bytes, fetch_json, fetch_bytes_async, bulk_download
 
-def get_all_items(catalog):
-    items = []
-    print(f"Processing {catalog.id} ({catalog.STAC_OBJECT_TYPE})")
+# Number of items included in the spectral report
+REPORT_ITEM_LIMIT = 50
 
-    # Process child catalogs/collections
-    for child_link in catalog.get_child_links():
-        print(f"Processing child {child_link.href}")
-        child = catalog.get_single_link("child").resolve_stac_object(root=catalog).target
-        if isinstance(child, (Catalog, Collection)):
-            items.extend(get_all_items(child))
+# Concurrent requests allowed on the --async path
+ASYNC_CONCURRENCY = 64
 
-    # Process items directly in this catalog
-    for item_link in catalog.get_item_links():
+# Charts allowed to queue up behind the PDF writer; enough to keep every core busy
+MAX_PENDING_CHARTS = 2 * (os.cpu_count() or 1)
+
+# Asset fields that may carry per-band metadata
+BAND_KEYS = ('eo:bands', 'raster:bands')
+
+# Size of a chart cell in the PDF, in points
+CHART_WIDTH, CHART_HEIGHT = 500, 200
+
+# One figure per process, cleared and redrawn for every chart instead of rebuilt.
+# It is sized so that at 72 dpi one pixel is one PDF point and the PNG drops into
+# its cell at native size, with no resampling.
+_fig, _ax = plt.subplots(figsize=(CHART_WIDTH / 72, CHART_HEIGHT / 72))
+
+class SessionStacIO(DefaultStacIO):
+    """StacIO that routes catalog/collection reads through the shared session
+
+    These index documents change as imagery is published, so they bypass the cache.
+    """
+    def read_text_from_href(self, href):
+        if urlparse(href).scheme in ("http", "https"):
+            return fetch_bytes(href, cache=False).decode("utf-8")
+        return super().read_text_from_href(href)
+
+    def json_loads(self, txt, *args, **kwargs):
+        return orjson.loads(txt)
+
+StacIO.set_default(SessionStacIO)
+
+def get_item_hrefs(catalog):
+    """Walk child catalogs breadth-first and collect every item href"""
+    hrefs = []
+    seen = set()
+    queue = deque([catalog])
+    while queue:
+        current = queue.popleft()
+        print(f"Processing {current.id} ({current.STAC_OBJECT_TYPE})")
+
+        # Queue child catalogs/collections
+        for child_link in current.get_child_links():
+            print(f"Processing child {child_link.href}")
+            child_href = child_link.get_absolute_href()
+            if child_href in seen:
+                continue
+            seen.add(child_href)
+            child = child_link.resolve_stac_object(root=catalog).target
+            if isinstance(child, (Catalog, Collection)):
+                queue.append(child)
+
+        # Collect items directly in this catalog
+        for item_link in current.get_item_links():
+            href = item_link.get_absolute_href()
+            if href not in seen:
+                seen.add(href)
+                hrefs.append(href)
+    return hrefs
+
+def fetch_item(href, catalog):
+    """Fetch a single item directly, bypassing pystac link resolution"""
+    try:
+        item = Item.from_dict(fetch_json(href), href=href, root=catalog, preserve_dict=False)
+        # Only geometry, properties and assets are read downstream, so drop the link graph
+        item.clear_links()
+        return item
+    except Exception as e:
+        print(f"Error loading item {href}: {str(e)}")
+        return None
+
+def get_all_items(catalog, hrefs):
+    """Yield catalog items in traversal order while later ones are fetched in parallel
+
+    At most MAX_WORKERS fetches are in flight at a time, so a consumer that
+    stops early (e.g. through islice) does not pay for the rest of the catalog.
+    """
+    hrefs = iter(hrefs)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        pending = deque(executor.submit(fetch_item, href, catalog) for href in islice(hrefs, MAX_WORKERS))
         try:
-            item = item_link.resolve_stac_object(root=catalog).target
-            if isinstance(item, Item):
-                items.append(item)
-        except Exception as e:
-            print(f"Error loading item {item_link.href}: {str(e)}")
-    return items
+            while pending:
+                item = pending.popleft().result()
+                for href in islice(hrefs, 1):
+                    pending.append(executor.submit(fetch_item, href, catalog))
+                if item is not None:
+                    yield item
+        finally:
+            for future in pending:
+                future.cancel()
+
+async def fetch_item_async(href, catalog, client, semaphore):
+    """Async counterpart of fetch_item"""
+    try:
+        data = orjson.loads(await fetch_bytes_async(href, client, semaphore))
+        item = Item.from_dict(data, href=href, root=catalog, preserve_dict=False)
+        item.clear_links()
+        return item
+    except Exception as e:
+        print(f"Error loading item {href}: {str(e)}")
+        return None
+
+async def get_all_items_async(catalog, limit=None):
+    """Fetch catalog items on a single event loop instead of a thread pool
+
+    Child catalogs are walked one level at a time with each level fetched
+    concurrently. Items are then fetched in traversal order until `limit` of
+    them (all if None) have loaded, topping up for any that fail, so the result
+    matches the thread-pool path.
+    """
+    # aiohttp is only needed for --async, so don't require it otherwise
+    import aiohttp
+
+    semaphore = asyncio.Semaphore(ASYNC_CONCURRENCY)
+    connector = aiohttp.TCPConnector(limit=ASYNC_CONCURRENCY)
+    async with aiohttp.ClientSession(connector=connector) as client:
+        hrefs = []
+        seen = set()
+        level = [catalog]
+        while level:
+            child_hrefs = []
+            for current in level:
+                print(f"Processing {current.id} ({current.STAC_OBJECT_TYPE})")
+                for child_link in current.get_child_links():
+                    child_href = child_link.get_absolute_href()
+                    if child_href not in seen:
+                        print(f"Processing child {child_link.href}")
+                        seen.add(child_href)
+                        child_hrefs.append(child_href)
+                for item_link in current.get_item_links():
+                    href = item_link.get_absolute_href()
+                    if href not in seen:
+                        seen.add(href)
+                        hrefs.append(href)
+
+            payloads = await asyncio.gather(*[fetch_bytes_async(href, client, semaphore, cache=False)
+                                             for href in child_hrefs])
+            children = [pystac.read_dict(orjson.loads(payload), href=href, root=catalog)
+                        for href, payload in zip(child_hrefs, payloads)]
+            level = [child for child in children if isinstance(child, (Catalog, Collection))]
+
+        items = []
+        start = 0
+        while start < len(hrefs) and (limit is None or len(items) < limit):
+            # Fetch only as many items as are still missing
+            batch = hrefs[start:] if limit is None else hrefs[start:start + limit - len(items)]
+            start += len(batch)
+            results = await asyncio.gather(*[fetch_item_async(href, catalog, client, semaphore) for href in batch])
+            items.extend(item for item in results if item is not None)
+        return items
 
 def get_spectral_info(item):
     """Extract spectral band information from an item's assets"""
-    bands = []
-    for asset_key, asset in item.assets.items():
-        if 'eo:bands' in asset.extra_fields:
-            for band in asset.extra_fields['eo:bands']:
-                band_info = {
-                    'name': band.get('name', 'N/A'),
-                    'common_name': band.get('common_name', 'N/A'),
-                    'center_wavelength': band.get('center_wavelength', 'N/A'),
-                    'asset': asset_key
-                }
-                bands.append(band_info)
-        elif 'raster:bands' in asset.extra_fields:
-            for band in asset.extra_fields['raster:bands']:
-                band_info = {
-                    'name': band.get('name', 'N/A'),
-                    'common_name': band.get('common_name', 'N/A'),
-                    'center_wavelength': band.get('center_wavelength', 'N/A'),
-                    'asset': asset_key
-                }
-                bands.append(band_info)
-    return bands
+    return [
+        {
+            'name': band.get('name', 'N/A'),
+            'common_name': band.get('common_name', 'N/A'),
+            'center_wavelength': band.get('center_wavelength', 'N/A'),
+            'asset': asset_key
+        }
+        for asset_key, asset in item.assets.items()
+        for band_key in BAND_KEYS if band_key in asset.extra_fields
+        for band in asset.extra_fields[band_key]
+    ]
 
 def create_spectral_chart(bands, item_id):
-    """Create matplotlib spectral profile plot with vertical labels"""
-    fig, ax = plt.subplots(figsize=(10, 4))
-    
+    """Render a spectral profile plot with vertical labels to PNG bytes
+
+    Runs in a worker process, so it takes and returns only picklable values,
+    and redraws that process's shared figure rather than creating a new one.
+    """
     # Extract valid wavelengths
     wavelengths = []
     band_names = []
@@ -69,22 +210,49 @@ def create_spectral_chart(bands, item_id):
     if not wavelengths:
         return None
 
+    _ax.clear()
+
     # Create spectral profile
-    ax.vlines(wavelengths, 0, 1, colors='blue', linewidth=2)
-    ax.set_xticks(wavelengths)
-    ax.set_xticklabels(band_names, rotation=90, ha='center')
-    ax.set_xlabel('Wavelength (nm)', labelpad=15)
-    ax.set_yticks([])
-    ax.set_title(f"Spectral Profile - {item_id}", pad=20)
-    ax.grid(axis='x', alpha=0.3)
+    _ax.vlines(wavelengths, 0, 1, colors='blue', linewidth=2)
+    _ax.set_xticks(wavelengths)
+    _ax.set_xticklabels(band_names, rotation=90, ha='center', fontsize=7)
+    _ax.set_xlabel('Wavelength (nm)', labelpad=10, fontsize=7)
+    _ax.set_yticks([])
+    _ax.set_title(f"Spectral Profile - {item_id}", pad=14, fontsize=8)
+    _ax.grid(axis='x', alpha=0.3)
 
     # Save to buffer
     buf = BytesIO()
-    plt.tight_layout()
-    plt.savefig(buf, format='png', dpi=150, bbox_inches='tight')
-    plt.close()
-    buf.seek(0)
-    return buf
+    # tight_layout already keeps the labels on the canvas, so skip bbox_inches='tight'
+    # and its extra measuring pass
+    _fig.tight_layout()
+    _fig.savefig(buf, format='png', dpi=72)
+    return buf.getvalue()
+
+def render_charts(items, executor):
+    """Yield (item, chart PNG) pairs in order while later charts render in the background"""
+    pending = deque()
+    for item in items:
+        pending.append((item, executor.submit(create_spectral_chart, get_spectral_info(item), item.id)))
+        if len(pending) >= MAX_PENDING_CHARTS:
+            item, future = pending.popleft()
+            yield item, future.result()
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
+
+# Every metadata table shares the same look, so build the style once
+_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0,0), (-1,0), (0.8, 0.8, 0.8)),
+    ('TEXTCOLOR', (0,0), (-1,0), (0, 0, 0)),
+    ('ALIGN', (0,0), (-1,-1), 'LEFT'),
+    ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0,0), (-1,-1), 8),
+    ('BOTTOMPADDING', (0,0), (-1,0), 6),
+    ('BACKGROUND', (0,1), (-1,-1), (0.95, 0.95, 0.95)),
+    ('GRID', (0,0), (-1,-1), 0.5, (0.7, 0.7, 0.7)),
+    ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+])
 
 def create_metadata_table(item):
     """Create a table with imagery metadata"""
@@ -100,17 +268,7 @@ def create_metadata_table(item):
     ]
 
     table = Table(data)
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0,0), (-1,0), (0.8, 0.8, 0.8)),
-        ('TEXTCOLOR', (0,0), (-1,0), (0, 0, 0)),
-        ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0,0), (-1,-1), 8),
-        ('BOTTOMPADDING', (0,0), (-1,0), 6),
-        ('BACKGROUND', (0,1), (-1,-1), (0.95, 0.95, 0.95)),
-        ('GRID', (0,0), (-1,-1), 0.5, (0.7, 0.7, 0.7)),
-        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-    ]))
+    table.setStyle(_TABLE_STYLE)
     return table
 
 def create_spectral_pdf(items, filename="Dragonette-Imagery-API/result/spectral_report.pdf"):
@@ -120,41 +278,66 @@ def create_spectral_pdf(items, filename="Dragonette-Imagery-API/result/spectral_
     
     doc = SimpleDocTemplate(filename, pagesize=letter)
     styles = getSampleStyleSheet()
+    heading_style = styles['Heading2']
+    italic_style = styles['Italic']
     elements = []
     
     # Title
     elements.append(Paragraph("Satellite Imagery Analysis Report", styles['Title']))
     elements.append(Spacer(1, 12))
 
-    # Create sections for each item
-    for i, item in enumerate(items):
-        bands = get_spectral_info(item)
-        chart_buf = create_spectral_chart(bands, item.id)
-
-        if chart_buf:
-            elements.append(Paragraph(f"Imagery Analysis: {item.id}", styles['Heading2']))
-            elements.append(Spacer(1, 6))
-            elements.append(Image(chart_buf, width=500, height=200))
-            elements.append(Spacer(1, 8))
-            elements.append(create_metadata_table(item))
-            elements.append(Spacer(1, 20))
-
-            if (i+1) % 2 == 0:
-                elements.append(PageBreak())
-        else:
-            elements.append(Paragraph(f"No spectral bands found for {item.id}", styles['Italic']))
-            elements.append(Spacer(1, 8))
+    # Create sections for each item as its chart comes back from the worker processes.
+    # Workers are spawned rather than forked because item fetch threads are still running.
+    with ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn")) as executor:
+        for i, (item, chart_png) in enumerate(render_charts(items, executor)):
+            if chart_png:
+                elements.append(Paragraph(f"Imagery Analysis: {item.id}", heading_style))
+                elements.append(Spacer(1, 6))
+                elements.append(Image(BytesIO(chart_png), width=CHART_WIDTH, height=CHART_HEIGHT))
+                elements.append(Spacer(1, 8))
+                elements.append(create_metadata_table(item))
+                elements.append(Spacer(1, 20))
+
+                if (i+1) % 2 == 0:
+                    elements.append(PageBreak())
+            else:
+                elements.append(Paragraph(f"No spectral bands found for {item.id}", italic_style))
+                elements.append(Spacer(1, 8))
 
     doc.build(elements)
     print(f"Updated spectral report saved to {filename}")
     
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a spectral report for items in the Wyvern STAC catalog")
+    fetch_mode = parser.add_mutually_exclusive_group()
+    fetch_mode.add_argument("--async", dest="use_async", action="store_true",
+                            help="fetch the catalog with asyncio/aiohttp instead of a thread pool")
+    fetch_mode.add_argument("--bulk-download-dir", metavar="DIR",
+                            help="download the report's item JSON into DIR with aria2c first, then read it from there "
+                                 "(DIR is also used as the cache directory)")
+    args = parser.parse_args()
+
+    if args.bulk_download_dir:
+        stac_fetch.CACHE_DIR = Path(args.bulk_download_dir)
+
     catalog_url = "https://wyvern-prod-public-open-data-program.s3.ca-central-1.amazonaws.com/catalog.json"
     catalog = Catalog.from_file(catalog_url)
-    all_items = get_all_items(catalog)
+    if args.use_async:
+        item_source = contextlib.nullcontext(iter(asyncio.run(get_all_items_async(catalog, limit=REPORT_ITEM_LIMIT))))
+    else:
+        hrefs = get_item_hrefs(catalog)
+        if args.bulk_download_dir:
+            # Only the report's items (plus the prefetch window) are ever read
+            bulk_download(hrefs[:REPORT_ITEM_LIMIT + MAX_WORKERS])
+        # Closed once the report is built so the remaining in-flight fetches are cancelled
+        item_source = contextlib.closing(get_all_items(catalog, hrefs))
+
+    with item_source as all_items:
+        items = islice(all_items, REPORT_ITEM_LIMIT)
 
-    if not all_items:
-        raise Exception("No items found in the catalog")
+        first_item = next(items, None)
+        if first_item is None:
+            raise Exception("No items found in the catalog")
 
-    create_spectral_pdf(all_items[:50])
\ No newline at end of file
+        create_spectral_pdf(chain([first_item], items))
\ No newline at end of file
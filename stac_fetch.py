@@ -0,0 +1,101 @@
+"""HTTP fetching and on-disk caching of STAC JSON shared by both scripts"""
+import requests
+from requests.adapters import HTTPAdapter
+from pathlib import Path
+import hashlib
+import orjson
+import os
+import shutil
+import subprocess
+import tempfile
+
+MAX_WORKERS = 32
+
+# Fetched item JSON is cached here keyed by URL; delete the directory to invalidate.
+# Only item documents are cached: they are immutable once published, whereas the
+# catalog and collection indexes gain links as new imagery is added.
+# Scripts may point this somewhere else (e.g. --bulk-download-dir) before fetching.
+CACHE_DIR = Path.home() / ".cache" / "dragonette"
+
+# Shared session so fetches reuse pooled keep-alive connections
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS))
+
+def cache_path(url):
+    """Locate the cache file for a URL"""
+    return CACHE_DIR / (hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json")
+
+def write_cache(path, content):
+    """Write a cache file atomically so readers never see a partial document"""
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=CACHE_DIR, suffix=".tmp", delete=False) as tmp:
+        tmp.write(content)
+    os.replace(tmp.name, path)
+
+def fetch_bytes(url, cache=True):
+    """Read a URL through the local cache, fetching and storing it on a miss
+
+    Pass cache=False for catalog/collection documents, which must always be fresh.
+    """
+    path = cache_path(url)
+    if cache and path.exists():
+        return path.read_bytes()
+
+    response = session.get(url)
+    response.raise_for_status()
+    if cache:
+        write_cache(path, response.content)
+    return response.content
+
+def fetch_json(url, cache=True):
+    """Fetch and parse a JSON document, through the local cache unless cache=False"""
+    return orjson.loads(fetch_bytes(url, cache=cache))
+
+async def fetch_bytes_async(url, client, semaphore, cache=True):
+    """Async counterpart of fetch_bytes, sharing the same cache"""
+    path = cache_path(url)
+    if cache and path.exists():
+        return path.read_bytes()
+
+    async with semaphore:
+        async with client.get(url) as response:
+            response.raise_for_status()
+            content = await response.read()
+    if cache:
+        write_cache(path, content)
+    return content
+
+def bulk_download(urls):
+    """Fill the cache with aria2c in one batch
+
+    Only worthwhile for very large catalogs where per-request overhead
+    dominates. Anything aria2c fails to download is fetched normally later.
+    """
+    aria2c = shutil.which("aria2c")
+    if aria2c is None:
+        raise Exception("--bulk-download-dir requires aria2c to be installed and on PATH")
+
+    missing = [url for url in urls if not cache_path(url).exists()]
+    if not missing:
+        return
+    print(f"Bulk downloading {len(missing)} items with aria2c...")
+
+    # Download into a staging directory so partial files never land in the cache
+    staging_dir = CACHE_DIR / "bulk"
+    staging_dir.mkdir(parents=True, exist_ok=True)
+    input_file = staging_dir / "urls.txt"
+    with open(input_file, "w") as f:
+        for url in missing:
+            f.write(f"{url}\n  out={cache_path(url).name}\n")
+
+    result = subprocess.run([aria2c, "-x16", "-j64", "--allow-overwrite=true", "--console-log-level=warn",
+                             "-d", str(staging_dir), "-i", str(input_file)])
+    if result.returncode != 0:
+        print(f"aria2c exited with status {result.returncode}; missing items will be fetched directly")
+
+    for url in missing:
+        staged = staging_dir / cache_path(url).name
+        if staged.exists() and not staged.with_name(staged.name + ".aria2").exists():
+            os.replace(staged, cache_path(url))
+    # Drop the input list and any partial downloads; those items are refetched directly
+    shutil.rmtree(staging_dir, ignore_errors=True)